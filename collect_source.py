@@ -1,4 +1,55 @@
 import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Chunk size used when streaming source files into the collected output
+COPY_BUFFER_SIZE = 1 << 20
+
+# Reads are I/O-bound, so use more threads than cores
+MAX_READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Output files kept open at once; older ones are closed and re-opened for
+# appending, which stays well under low descriptor limits (256 on macOS)
+MAX_OPEN_OUTFILES = 16
+
+def _read_head(file_path):
+    """
+    Reads up to COPY_BUFFER_SIZE bytes from the start of a file.
+
+    Returns:
+        tuple: The bytes read and whether the file may contain more data.
+    """
+    with open(file_path, 'rb') as infile:
+        data = infile.read(COPY_BUFFER_SIZE)
+    return data, len(data) == COPY_BUFFER_SIZE
+
+def _get_outfile(outfiles, output_dir, subdirectory_name):
+    """Returns the open output file for a subdirectory, closing the least recently used beyond MAX_OPEN_OUTFILES."""
+    outfile = outfiles.pop(subdirectory_name, None)
+    if outfile is None:
+        output_filepath = os.path.join(output_dir, f"{subdirectory_name}.txt")
+        # Open the output file in append mode to gather all file contents
+        outfile = open(output_filepath, 'ab')
+        while len(outfiles) >= MAX_OPEN_OUTFILES:
+            outfiles.pop(next(iter(outfiles))).close()
+    outfiles[subdirectory_name] = outfile
+    return outfile
+
+def _write_file(outfile, filename, file_path, future):
+    """Appends one file's content, read by the worker pool, to its output file."""
+    try:
+        data, truncated = future.result()
+        outfile.write(f"--- Content from: {filename} ---\n".encode('utf-8'))
+        outfile.write(data)
+        if truncated:
+            # Stream the remainder of large files in bounded chunks
+            with open(file_path, 'rb') as infile:
+                infile.seek(len(data))
+                shutil.copyfileobj(infile, outfile, length=COPY_BUFFER_SIZE)
+        outfile.write(b"\n\n")
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
 
 def collect_source_code(source_dir, output_dir):
     """
@@ -13,28 +64,52 @@ def collect_source_code(source_dir, output_dir):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Recursively walk through the source directory
-    for dirpath, _, filenames in os.walk(source_dir):
-        # Skip the root source directory itself, only process subdirectories
-        if dirpath == source_dir:
-            continue
+    # Recently used output files, keyed by subdirectory name, least recently
+    # used first, so directories sharing a basename mostly reuse a handle
+    outfiles = {}
+    # Reads are submitted to the pool while walking; results are written from
+    # this thread in submission order, which keeps the output deterministic
+    # and bounds how many file contents are held in memory at once
+    in_flight = deque()
+    max_in_flight = MAX_READ_WORKERS * 4
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_READ_WORKERS) as executor:
+            # Walk the source directory breadth-first with os.scandir so the cached
+            # DirEntry type information is reused instead of stat-ing every path again
+            pending = deque([(source_dir, 0)])
+            while pending:
+                dirpath, depth = pending.popleft()
+                filepaths = []
+                try:
+                    with os.scandir(dirpath) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append((entry.path, depth + 1))
+                            elif entry.is_file(follow_symlinks=False):
+                                filepaths.append((entry.name, entry.path))
+                except OSError as e:
+                    print(f"Error reading directory {dirpath}: {e}")
+                    continue
 
-        # Get the base name of the current directory
-        subdirectory_name = os.path.basename(dirpath)
-        output_filename = f"{subdirectory_name}.txt"
-        output_filepath = os.path.join(output_dir, output_filename)
+                # Skip the root source directory itself, only process subdirectories
+                if depth == 0:
+                    continue
 
-        # Open the output file in append mode to gather all file contents
-        with open(output_filepath, 'a', encoding='utf-8') as outfile:
-            for filename in filenames:
-                file_path = os.path.join(dirpath, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as infile:
-                        outfile.write(f"--- Content from: {filename} ---\n")
-                        outfile.write(infile.read())
-                        outfile.write("\n\n")
-                except Exception as e:
-                    print(f"Error reading file {file_path}: {e}")
+                # Get the base name of the current directory
+                subdirectory_name = os.path.basename(dirpath)
+
+                for filename, file_path in filepaths:
+                    if len(in_flight) >= max_in_flight:
+                        name, *args = in_flight.popleft()
+                        _write_file(_get_outfile(outfiles, output_dir, name), *args)
+                    in_flight.append((subdirectory_name, filename, file_path, executor.submit(_read_head, file_path)))
+
+            while in_flight:
+                name, *args = in_flight.popleft()
+                _write_file(_get_outfile(outfiles, output_dir, name), *args)
+    finally:
+        for outfile in outfiles.values():
+            outfile.close()
 
 if __name__ == "__main__":
     # --- Configuration ---
@@ -1,20 +1,25 @@
  
 import asyncio
+import contextlib
 import uuid
 from google.adk.runners import Runner
 from google.adk.events import Event
 import os
+import sys
 from sentient_agent.memory.postgres_memory_service import PostgresSessionService
 from google.adk.sessions import InMemorySessionService,DatabaseSessionService
 from sentient_agent.agent import root_agent as sentient_agent
 from google.adk.agents.llm_agent import LlmAgent
 from google.genai.types import Part, Content
-from google.genai.types import FunctionResponse
+from google.genai.types import FunctionCall, FunctionResponse
 from google.adk.tools.tool_confirmation import ToolConfirmation
+from types import MappingProxyType
 from typing import AsyncGenerator, Dict, Any
 
 ADK_AUTH_FN = "adk_request_credential"
 ADK_CONFIRMATION_FN = 'adk_request_confirmation'
+# Set DEBUG_TOOL_ARGS=1 to print the arguments of every tool call
+DEBUG_TOOL_ARGS = os.getenv("DEBUG_TOOL_ARGS", "").lower() in ("1", "true")
 
 # --- 1. CONSTRUCT THE DATABASE URL ---
 DB_USER = os.getenv("DB_USER")
@@ -43,47 +48,80 @@ runner = Runner(
     session_service=session_service
 ) 
 MINIMAL_AUTH_SCHEME_DICT = {"type": "http", "scheme": "bearer"} 
+# Must match the credential key requested by execute_shell_command
+CUSTOM_SUDO_KEY = "cli_sudo_password_prompt"
+
+# The parts of the AuthConfig response that never change between resumes;
+# only the exchanged credential carrying the password is added per call.
+AUTH_CONFIG_TEMPLATE = MappingProxyType({
+    # REQUIRED structural fields:
+    "authScheme": MINIMAL_AUTH_SCHEME_DICT, # Fills the missing field in validation [1]
+    "credentialKey": CUSTOM_SUDO_KEY,       # Required for storage lookup [5, 6]
+    # Optional: Include custom fields used for the initial prompt (good practice)
+    "type": "sudo_password_prompt",
+    "prompt_message": "  provide   sudo password ",
+})
+
+def _make_auth_signal(call: FunctionCall) -> Dict[str, Any]:
+    """Builds the pause signal for an authentication request."""
+    return {"type": "auth", "id": call.id}
+
+def _make_confirm_signal(call: FunctionCall) -> Dict[str, Any]:
+    """Prints the confirmation prompt and builds the pause signal for it."""
+    # The arguments for ADK_CONFIRMATION_FN contain the requested ToolConfirmation object [5, 6]
+    tool_conf_data = call.args.get('toolConfirmation', {})
+
+    # Extract the hint text from the payload
+    # Note: We assume toolConfirmation is structured or parsed JSON/Dict 
+    # containing the 'hint' field, as defined in the ToolConfirmation model [7, 8].
+    hint = tool_conf_data.get('hint', 'User confirmation required.')
+
+    print(f"\n[STATUS] Agent requires confirmation (call_id: {call.id})")
+    print(f"[PROMPT] {hint}")
+    return {"type": "confirm", "id": call.id}
+
+# Maps the ADK function calls that pause a run to the builder of their pause signal
+PAUSE_HANDLERS = {
+    ADK_AUTH_FN: _make_auth_signal,
+    ADK_CONFIRMATION_FN: _make_confirm_signal,
+}
 
 async def stream_and_parse_events(event_stream:AsyncGenerator[Event, None]):
     """
     Streams all events, prints them, and returns a 'pause signal' if one is detected.
     This function consolidates the event loop to avoid duplication.
     """
+    _print = sys.stdout.write
     async for event in event_stream:
-        # Print all relevant event info for detailed debugging
-        if event.content and event.content.parts:
+        content = event.content
+        parts = content.parts if content else None
+        has_function_call = False
+        if parts:
             # Check all parts for text content
-            for part in event.content.parts:
+            for part in parts:
                 if part.text:
-                    text_chunk = part.text
                     # Print the text chunk, including the thoughts if they are streamed as text
-                    print(text_chunk, end="", flush=True)
+                    _print(part.text)
+                if part.function_call:
+                    has_function_call = True
+            # One flush per event instead of one per text chunk
+            sys.stdout.flush()
+
+        # Fast path: text-only events carry no tool calls to inspect, and partial
+        # (streamed) chunks are only printed; tool calls arrive on the final event
+        if not has_function_call or event.partial:
+            continue
+
         function_calls = event.get_function_calls()
-        
         if function_calls:
             for call in function_calls:
                 print(f"\n[STATUS: TOOL CALL] Agent requests to execute: {call.name}")
-                print(f"   | Arguments: {dict(call.args)}")
-                if call.name == ADK_AUTH_FN:                    
-                    auth_call_id = call.id
-                    return {"type": "auth", "id": auth_call_id}
-                if call.name == ADK_CONFIRMATION_FN:
-                    confirmation_call_id = call.id
-                    
-                    # The arguments for ADK_CONFIRMATION_FN contain the requested ToolConfirmation object [5, 6]
-                    tool_conf_data = call.args.get('toolConfirmation', {})
-                    
-                    # Extract the hint text from the payload
-                    # Note: We assume toolConfirmation is structured or parsed JSON/Dict 
-                    # containing the 'hint' field, as defined in the ToolConfirmation model [7, 8].
-                    hint = tool_conf_data.get('hint', 'User confirmation required.')
-                    
-                    print(f"\n[STATUS] Agent requires confirmation (call_id: {confirmation_call_id})")
-                    print(f"[PROMPT] {hint}")
-                    
+                if DEBUG_TOOL_ARGS:
+                    print(f"   | Arguments: {call.args}")
+                pause_handler = PAUSE_HANDLERS.get(call.name)
+                if pause_handler:
                     # Pause the execution stream and return the signal
-                    return {"type": "confirm", "id": confirmation_call_id}
-            
+                    return pause_handler(call)
 
     print() # Final newline for clean output
     return None # No pause detected, task is complete or continuing
@@ -91,42 +129,25 @@ async def stream_and_parse_events(event_stream:AsyncGenerator[Event, None]):
 # --- 3. RESUME HANDLERS ---
 async def handle_auth_resume(session_id: str, auth_call_id: str, password: str):
     """Resumes the agent after an authentication pause."""
-    print(f"\n[CLIENT] Sending password back to resume...")
-    CUSTOM_SUDO_KEY = "cli_sudo_password_prompt"
-    
     print(f"\n[CLIENT] Sending password back to agent (call_id: {auth_call_id}) to resume task...")
 
-    # 1. Package the user's password into an AuthCredential structure (HttpAuth/HttpCredentials)
+    # Package the user's password into an AuthCredential structure (HttpAuth/HttpCredentials)
     # Since this is a simple password, we model it as an HTTP Bearer token credential.
-    user_credential_dict = {
-        # AuthType must match AuthCredentialTypes.HTTP [4]
-        "authType": "http", 
-        "http": {
-            "scheme": "bearer",
-            "credentials": {"token": password} # Password provided here [2]
-        }
-    }
-    
-    # 2. Construct the FULL AuthConfig dictionary to satisfy validation.
-    # It must include the original structural fields (auth_scheme) and the new credential.
-    
- 
-    
     auth_config_content: Dict[str, Any] = {
-        # REQUIRED structural fields:
-        "authScheme": MINIMAL_AUTH_SCHEME_DICT, # Fills the missing field in validation [1]
-        "credentialKey": CUSTOM_SUDO_KEY,       # Required for storage lookup [5, 6]
-        
+        **AUTH_CONFIG_TEMPLATE,
         # This field tells the framework what credential was successfully exchanged/collected
-        # (This is where the user's password data is located)
-        "exchangedAuthCredential": user_credential_dict,
-        
-        # Optional: Include custom fields used for the initial prompt (good practice)
-        "type": "sudo_password_prompt",
-        "prompt_message": "  provide   sudo password "
+        "exchangedAuthCredential": {
+            # AuthType must match AuthCredentialTypes.HTTP [4]
+            "authType": "http",
+            "http": {
+                "scheme": "bearer",
+                "credentials": {"token": password} # Password provided here [2]
+            }
+        },
     }
     auth_response = FunctionResponse(name=ADK_AUTH_FN, id=auth_call_id, response=auth_config_content)
-    resume_content = Content(role='user', parts=[Part.from_function_response(auth_response)])
+    # Part.from_function_response only takes name/response keywords and would drop the call id
+    resume_content = Content(role='user', parts=[Part(function_response=auth_response)])
     return runner.run_async(user_id=USER_ID, session_id=session_id, new_message=resume_content)
 
 async def handle_confirmation_resume(session_id: str, confirm_call_id: str, confirmed: bool):
@@ -142,9 +163,20 @@ async def handle_confirmation_resume(session_id: str, confirm_call_id: str, conf
         id=confirm_call_id, 
         response=confirmation_payload
     )
-    resume_content = Content(role='user', parts=[Part.from_function_response(confirmation_response)])
+    resume_content = Content(role='user', parts=[Part(function_response=confirmation_response)])
     return runner.run_async(  user_id=USER_ID, session_id=session_id, new_message=resume_content)
 
+async def async_input(prompt: str) -> str:
+    """Reads a line from stdin on a worker thread so the event loop keeps running."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, input, prompt)
+
+def session_turn():
+    """Binds one database connection to an agent turn when the session service supports it."""
+    if isinstance(session_service, PostgresSessionService):
+        return session_service.turn()
+    return contextlib.nullcontext()
+
 # --- 4. MAIN AGENT TASK CONTROLLER ---
 async def run_agent_task(user_input: str, session_id: str):
     """
@@ -158,7 +190,9 @@ async def run_agent_task(user_input: str, session_id: str):
     event_stream = runner.run_async(  session_id=session_id, user_id=USER_ID,new_message=user_content)
 
     while event_stream:
-        pause_signal = await stream_and_parse_events(event_stream)
+        # The connection is released before any pause so it is not held while waiting on the user
+        async with session_turn():
+            pause_signal = await stream_and_parse_events(event_stream)
 
         if pause_signal is None:
             # The event stream finished without pausing
@@ -166,147 +200,16 @@ async def run_agent_task(user_input: str, session_id: str):
             continue
 
         if pause_signal["type"] == "auth":
-            password = input("Sudo Password Required: ")
+            password = await async_input("Sudo Password Required: ")
             event_stream = await handle_auth_resume(session_id, pause_signal["id"], password)
         
         elif pause_signal["type"] == "confirm":
-            choice = input("Confirm? [y/n]: ")
+            choice = await async_input("Confirm? [y/n]: ")
             confirmed = choice.lower().strip() == 'y'
             event_stream = await handle_confirmation_resume(session_id, pause_signal["id"], confirmed)
 
     print("--- Task Complete ---")
 
-async def handle_auth_resume(app_name: str, user_id: str, session_id: str, auth_call_id: str, password: str):
-    """Sends the user-provided password back to the runner to resume the paused agent."""
-     # Constants must match the original request made by execute_shell_command
-   
-    CUSTOM_SUDO_KEY = "cli_sudo_password_prompt"
-    
-    print(f"\n[CLIENT] Sending password back to agent (call_id: {auth_call_id}) to resume task...")
-
-    # 1. Package the user's password into an AuthCredential structure (HttpAuth/HttpCredentials)
-    # Since this is a simple password, we model it as an HTTP Bearer token credential.
-    user_credential_dict = {
-        # AuthType must match AuthCredentialTypes.HTTP [4]
-        "authType": "http", 
-        "http": {
-            "scheme": "bearer",
-            "credentials": {"token": password} # Password provided here [2]
-        }
-    }
-    
-    # 2. Construct the FULL AuthConfig dictionary to satisfy validation.
-    # It must include the original structural fields (auth_scheme) and the new credential.
-    
- 
-    
-    auth_config_content: Dict[str, Any] = {
-        # REQUIRED structural fields:
-        "authScheme": MINIMAL_AUTH_SCHEME_DICT, # Fills the missing field in validation [1]
-        "credentialKey": CUSTOM_SUDO_KEY,       # Required for storage lookup [5, 6]
-        
-        # This field tells the framework what credential was successfully exchanged/collected
-        # (This is where the user's password data is located)
-        "exchangedAuthCredential": user_credential_dict,
-        
-        # Optional: Include custom fields used for the initial prompt (good practice)
-        "type": "sudo_password_prompt",
-        "prompt_message": "  provide   sudo password "
-    }
-    auth_response = FunctionResponse(name=ADK_AUTH_FN, id=auth_call_id, response=auth_config_content)
-    # Explicitly constructing the Part object (Fix for previous TypeError)
-    auth_response_part = Part(function_response=auth_response)
-    response_content = Content(role='user', parts=[auth_response_part])
-
-
-  
-
-    event_stream = runner.run_async(
-  
-        user_id=USER_ID,
-        session_id=session_id,
-        new_message=response_content
-    )
-    # Stream the rest of the events from the resumed execution
-    async for event in event_stream:
-        if event.content and event.content.parts:
-            # Check all parts for text content
-            for part in event.content.parts:
-                if part.text:
-                    text_chunk = part.text
-                    # Print the text chunk, including the thoughts if they are streamed as text
-                    print(text_chunk, end="", flush=True)
-
-# # --- 3. Programmatic Execution Logic ---
-# async def run_agent_task(user_input: str, session_id: str):
-#     """Runs the agent and handles the interactive pause/resume cycle for authentication."""
-#     print(f"\n--- Running task for session: {session_id} ---")
-#     print(f"User Input: {user_input}")
-#     print("Agent Output: ", end="", flush=True)
-
-#     # 1. Create the user input content object
-#     user_content = Content(role="user", parts=[Part(text=user_input)])
-    
-#     # 2. Call runner.run_async, which is the primary method for execution [2, 18]
-#     # This returns an asynchronous generator of Event objects [9, 19].
-#     event_stream = runner.run_async(
-#         user_id= USER_ID,
-#         session_id=session_id,
-#         new_message=user_content
-#     )  
-#     auth_required, auth_call_id = False, None
- 
-#     async for event in event_stream:
-        
-        
-#         # 1. Look for Function Calls (Tool Request Status)
-#         # These events signal the LLM asking to run a tool [5, 6].
-#         function_calls = event.get_function_calls()
-#         if function_calls:
-#             for call in function_calls:
-#                 print(f"\n[STATUS: TOOL CALL] Agent requests to execute: {call.name}")
-#                 print(f"   | Arguments: {dict(call.args)}")
-#                 if call.name == ADK_AUTH_FN:
-#                     auth_required = True
-#                     auth_call_id = call.id
-#                     print(f"\n\n[CLIENT] PAUSE DETECTED. Agent requires sudo password (call_id: {auth_call_id}).")
-#                     break
-#         if auth_required: break
-
-                    
-#         # 2. Look for Function Responses (Tool Results/Perception)
-#         # These events signal the result of the tool execution that the agent receives [5, 6].
-#         function_responses = event.get_function_responses()
-#         if function_responses:
-#             for response in function_responses:
-#                 print(f"\n[STATUS: TOOL RESULT] Agent received result for: {response.name}")
-#                 if response.response:
-#                     print(f"   | Result Status: {response.response.get('status', 'N/A')}")
-#                     print(f"   | Full Output: {response.response.get('output', 'N/A')}")
-
-#         # 3. Look for State Updates (Side Effects/Commitment)
-#         # The Runner coordinates with Services to commit changes signaled here [10-12].
-#         if event.actions and event.actions.state_delta:
-#             print(f"\n[STATUS: STATE COMMIT] Runner confirmed changes: {event.actions.state_delta}")
-
-#         # 4. Look for Text Content (Thoughts and Final Response)
-#         # This handles streaming text chunks [5, 13].
-#         if event.content and event.content.parts:
-#             # Check all parts for text content
-#             for part in event.content.parts:
-#                 if part.text:
-#                     text_chunk = part.text
-#                     # Print the text chunk, including the thoughts if they are streamed as text
-#                     print(text_chunk, end="", flush=True)
-#     if auth_required and auth_call_id:
-#             # --- THIS IS THE INTERACTIVE PART ---
-#             sudo_password = input("Please enter your sudo password: ")
-           
-
-#             await handle_auth_resume(app_name=APP_NAME, user_id=USER_ID, session_id=session_id, auth_call_id=auth_call_id, password=sudo_password)
-#         # After the loop finishes, we print a newline.
-#     print("\n--- Task Complete ---")
-
 async def main():
  
     # We will use a consistent session_id to test the agent's memory (persistence of state/history).
@@ -334,6 +237,8 @@ async def main():
 
     # Scenario 1: Initial Question
     while True:
+        # A plain input(): Ctrl+C is the only way out of this loop, and asyncio.run
+        # would wait on shutdown for an executor thread still blocked in input()
         user_input = input("Your Turn....  ")
         await run_agent_task(
             user_input=user_input,
@@ -13,10 +13,13 @@
 # limitations under the License.
 
 import os
-import json
+import asyncio
+import contextlib
+import contextvars
 import asyncpg
+import orjson
 from dotenv import load_dotenv
-from typing import List, Optional, Any
+from typing import AsyncIterator, List, Optional, Any
 from uuid import uuid4
 
 # Note the change in the import path to match the official ADK structure
@@ -28,6 +31,90 @@ from pydantic import Field
 # Load environment variables from .env file
 load_dotenv()
 
+# Maximum number of buffered events written by a single COPY
+EVENT_BATCH_SIZE = 256
+EVENT_COLUMNS = ['app_name', 'user_id', 'session_id', 'timestamp', 'event']
+# Rows fetched per round trip when streaming events through a cursor
+EVENT_CURSOR_PREFETCH = 100
+
+# Binary JSONB values are prefixed with a format version byte
+JSONB_FORMAT_VERSION = b'\x01'
+
+def _encode_jsonb(value: Any) -> bytes:
+    """Encodes a value to the binary JSONB wire format."""
+    # Non-string keys are coerced like json.dumps did, instead of raising
+    return JSONB_FORMAT_VERSION + orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+def _decode_jsonb(data: bytes) -> Any:
+    """Decodes a binary JSONB value, skipping the version byte."""
+    return orjson.loads(memoryview(data)[1:])
+
+# Connection bound to the current agent turn by PostgresSessionService.turn()
+_turn_conn: contextvars.ContextVar[Optional[asyncpg.Connection]] = contextvars.ContextVar(
+    '_turn_conn', default=None
+)
+
+# SQL for every query the service issues. The text never varies, so asyncpg's
+# per-connection statement cache prepares each one once per connection.
+SQL_STATEMENTS = {
+    'create_session': """
+        INSERT INTO sessions (app_name, user_id, session_id, state)
+        VALUES ($1, $2, $3, $4);
+    """,
+    'get_session_state': """
+        SELECT state FROM sessions
+        WHERE app_name = $1 AND user_id = $2 AND session_id = $3;
+    """,
+    # The newest rows are selected first, then returned in chronological order.
+    # LIMIT NULL returns every row, so the limit is always bound as a parameter.
+    # Events come back as JSON text so pydantic can validate them straight from JSON.
+    'get_session_events': """
+        SELECT timestamp, event::text AS event FROM (
+            SELECT timestamp, event FROM events
+            WHERE app_name = $1 AND user_id = $2 AND session_id = $3
+            ORDER BY timestamp DESC
+            LIMIT $4
+        ) AS recent
+        ORDER BY timestamp ASC;
+    """,
+    'get_session_events_after': """
+        SELECT timestamp, event::text AS event FROM (
+            SELECT timestamp, event FROM events
+            WHERE app_name = $1 AND user_id = $2 AND session_id = $3 AND timestamp > $4
+            ORDER BY timestamp DESC
+            LIMIT $5
+        ) AS recent
+        ORDER BY timestamp ASC;
+    """,
+    'update_session': """
+        INSERT INTO sessions (app_name, user_id, session_id, state)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (app_name, user_id, session_id)
+        DO UPDATE SET state = EXCLUDED.state;
+    """,
+    'list_sessions': """
+        SELECT session_id FROM sessions
+        WHERE app_name = $1 AND user_id = $2;
+    """,
+    # Fallback for single rows when a batched COPY of events fails
+    'insert_event': """
+        INSERT INTO events (app_name, user_id, session_id, timestamp, event)
+        VALUES ($1, $2, $3, $4, $5);
+    """,
+    'delete_session': "DELETE FROM sessions WHERE app_name = $1 AND user_id = $2 AND session_id = $3;",
+}
+
+class EventPersistenceError(Exception):
+    """Raised by flush_events() when buffered events could not be written."""
+
+    def __init__(self, failed: list[tuple[tuple, Exception]]):
+        self.failed = failed
+        record, error = failed[0]
+        super().__init__(
+            f"Could not persist {len(failed)} buffered event(s); "
+            f"first failure for session '{record[2]}': {error}"
+        )
+
 class GetSessionConfig(BaseModel):
   """The configuration of getting a session."""
 
@@ -49,6 +136,10 @@ class PostgresSessionService(BaseSessionService):
     """
     def __init__(self):
         self.pool = None
+        self._event_queue: Optional[asyncio.Queue] = None
+        self._flusher_task: Optional[asyncio.Task] = None
+        # Buffered events that could not be written, with the error for each
+        self._failed_events: list[tuple[tuple, Exception]] = []
 
     async def connect(self):
         """Establishes the asynchronous database connection pool."""
@@ -58,16 +149,37 @@ class PostgresSessionService(BaseSessionService):
                 port=os.getenv("DB_PORT"),
                 database=os.getenv("DB_NAME"),
                 user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD")
+                password=os.getenv("DB_PASSWORD"),
+                # Keep a couple of warm connections, allow bursts of event writes,
+                # and hand idle backends back to Postgres after a minute
+                min_size=2,
+                max_size=16,
+                max_inactive_connection_lifetime=60,
+                command_timeout=30,
+                # init runs once per new connection, unlike setup which runs on every acquire
+                init=self._init_connection,
             )
             await self.init_db()
+            self._event_queue = asyncio.Queue()
+            self._flusher_task = asyncio.create_task(self._flusher())
             print("Successfully connected to PostgreSQL database and created connection pool.")
         except Exception as e:
             print(f"Error: Could not connect to PostgreSQL database.\n{e}")
             raise
 
+    @staticmethod
+    async def _init_connection(conn: asyncpg.Connection):
+        """Registers the binary JSONB codec so JSONB values map directly to Python objects."""
+        await conn.set_type_codec(
+            'jsonb',
+            encoder=_encode_jsonb,
+            decoder=_decode_jsonb,
+            schema='pg_catalog',
+            format='binary',
+        )
+
     async def init_db(self):
-        """Creates the necessary tables if they do not exist."""
+        """Creates the necessary tables and indexes if they do not exist."""
         print("Initializing database tables...")
         async with self.pool.acquire() as conn:
             await conn.execute('''
@@ -87,16 +199,154 @@ class PostgresSessionService(BaseSessionService):
                     session_id TEXT NOT NULL,
                     timestamp FLOAT NOT NULL,
                     event JSONB NOT NULL,
-                    FOREIGN KEY (app_name, user_id, session_id) REFERENCES sessions (app_name, user_id, session_id)
+                    CONSTRAINT events_app_name_user_id_session_id_fkey
+                        FOREIGN KEY (app_name, user_id, session_id)
+                        REFERENCES sessions (app_name, user_id, session_id)
+                        ON DELETE CASCADE
                 );
             ''')
-        print("Tables created or already exist.")
+            # Tables created before the foreign key cascaded are upgraded in place
+            await conn.execute('''
+                DO $$
+                BEGIN
+                    IF EXISTS (
+                        SELECT 1 FROM pg_constraint
+                        WHERE conname = 'events_app_name_user_id_session_id_fkey'
+                          AND conrelid = 'events'::regclass
+                          AND confdeltype <> 'c'
+                    ) THEN
+                        ALTER TABLE events
+                            DROP CONSTRAINT events_app_name_user_id_session_id_fkey,
+                            ADD CONSTRAINT events_app_name_user_id_session_id_fkey
+                                FOREIGN KEY (app_name, user_id, session_id)
+                                REFERENCES sessions (app_name, user_id, session_id)
+                                ON DELETE CASCADE;
+                    END IF;
+                END $$;
+            ''')
+            # Serves get_session's per-session, newest-first event lookups
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS events_session_ts_idx
+                ON events (app_name, user_id, session_id, timestamp DESC);
+            ''')
+        print("Tables and indexes created or already exist.")
+
+    async def _flusher(self):
+        """Background task that drains buffered events into the events table in batches."""
+        queue = self._event_queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < EVENT_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._write_events(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _write_events(self, batch: list[tuple]):
+        """
+        Writes a batch of buffered events with one COPY.
+
+        If the COPY fails, the rows are retried one at a time so a single bad
+        row does not take the rest of the batch with it.
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.copy_records_to_table('events', records=batch, columns=EVENT_COLUMNS)
+            return
+        except Exception as e:
+            print(f"Error: Could not persist {len(batch)} buffered event(s) in one batch, retrying row by row.\n{e}")
+        await self._insert_events(batch)
+
+    async def _insert_events(self, records: list[tuple]):
+        """Inserts events one row at a time; rows that fail are kept to be retried and reported."""
+        for record in records:
+            try:
+                async with self.pool.acquire() as conn:
+                    await conn.execute(SQL_STATEMENTS['insert_event'], *record)
+            except Exception as e:
+                print(f"Error: Could not persist an event for session '{record[2]}', keeping it for a retry.\n{e}")
+                self._failed_events.append((record, e))
+
+    async def _drain_events(self):
+        """Waits for the buffered events to be written, then retries the ones that failed before."""
+        if self._event_queue is not None:
+            await self._event_queue.join()
+        if self._failed_events:
+            failed, self._failed_events = self._failed_events, []
+            await self._insert_events([record for record, _ in failed])
+
+    async def flush_events(
+        self,
+        *,
+        app_name: Optional[str] = None,
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ):
+        """
+        Waits until every buffered event has been written to the database.
+
+        Events that could not be written are retried on each flush and kept
+        until they succeed. Given a session, only its failures are raised, so
+        one session's bad rows never fail reads of another.
+
+        Raises:
+            EventPersistenceError: If some buffered events could not be written.
+        """
+        await self._drain_events()
+        failed = [
+            (record, error) for record, error in self._failed_events
+            if session_id is None or record[:3] == (app_name, user_id, session_id)
+        ]
+        if failed:
+            raise EventPersistenceError(failed)
 
     async def close(self):
-        """Closes the database connection pool."""
-        if self.pool:
-            await self.pool.close()
-            print("PostgreSQL connection pool closed.")
+        """Flushes buffered events and closes the database connection pool."""
+        try:
+            if self._flusher_task is not None:
+                await self.flush_events()
+        finally:
+            if self._flusher_task is not None:
+                self._flusher_task.cancel()
+                try:
+                    await self._flusher_task
+                except asyncio.CancelledError:
+                    pass
+                self._flusher_task = None
+            if self.pool:
+                await self.pool.close()
+                print("PostgreSQL connection pool closed.")
+
+    @contextlib.asynccontextmanager
+    async def turn(self):
+        """
+        Binds one pooled connection to the current agent turn.
+
+        Session reads and writes made inside the block reuse this connection,
+        so a turn checks out the pool once and reuses that connection's
+        statement cache. Calls within a turn must not run concurrently.
+        """
+        if _turn_conn.get() is not None:
+            yield
+            return
+        async with self.pool.acquire() as conn:
+            token = _turn_conn.set(conn)
+            try:
+                yield
+            finally:
+                _turn_conn.reset(token)
+
+    @contextlib.asynccontextmanager
+    async def _connection(self):
+        """Yields the current turn's connection, or a pooled one outside a turn."""
+        conn = _turn_conn.get()
+        if conn is not None:
+            yield conn
+        else:
+            async with self.pool.acquire() as conn:
+                yield conn
 
     async def create_session(
         self,
@@ -109,13 +359,9 @@ class PostgresSessionService(BaseSessionService):
         """Explicitly creates a new, empty session in the database."""
         session_id = session_id or str(uuid4())
         initial_state = state or {}
-        sql = """
-            INSERT INTO sessions (app_name, user_id, session_id, state)
-            VALUES ($1, $2, $3, $4);
-        """
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute(sql, app_name, user_id, session_id, json.dumps(initial_state))
+            async with self._connection() as conn:
+                await conn.execute(SQL_STATEMENTS['create_session'], app_name, user_id, session_id, initial_state)
             print(f"Session '{session_id}' created successfully.")
             return Session(session_id=session_id, state=initial_state)
         except asyncpg.exceptions.UniqueViolationError:
@@ -130,33 +376,56 @@ class PostgresSessionService(BaseSessionService):
         config: Optional[GetSessionConfig] = None,
     ) -> Optional[Session]:
         """Retrieves a session from the database. Returns None if not found."""
-        sql = """
-            SELECT state FROM sessions
-            WHERE app_name = $1 AND user_id = $2 AND session_id = $3;
-        """
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow(sql, app_name, user_id, session_id)
+        await self.flush_events(app_name=app_name, user_id=user_id, session_id=session_id)
+        async with self._connection() as conn:
+            result = await conn.fetchrow(SQL_STATEMENTS['get_session_state'], app_name, user_id, session_id)
             if not result:
                 return None
-            state = json.loads(result['state'])
+            state = result['state']
             events = []
             if config is not None:
-                params = [app_name, user_id, session_id]
-                sql_events = """
-                    SELECT timestamp, event FROM events
-                    WHERE app_name = $1 AND user_id = $2 AND session_id = $3
-                """
-                if config.after_timestamp is not None:
-                    sql_events += " AND timestamp > $4"
-                    params.append(config.after_timestamp)
-                sql_events += " ORDER BY timestamp DESC"
-                if config.num_recent_events is not None:
-                    sql_events += f" LIMIT {config.num_recent_events}"
-                rows = await conn.fetch(sql_events, *params)
-                sorted_rows = sorted(rows, key=lambda r: r['timestamp'])
-                events = [Event(**json.loads(row['event'])) for row in sorted_rows]
+                query, args = self._events_query(app_name, user_id, session_id, config)
+                rows = await conn.fetch(query, *args)
+                events = [Event.model_validate_json(row['event']) for row in rows]
             return Session(session_id=session_id, state=state, events=events)
 
+    async def iter_events(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> AsyncIterator[Event]:
+        """
+        Streams a session's events in chronological order without loading them all.
+
+        Rows are read through a server-side cursor on a dedicated connection,
+        so memory use stays bounded by EVENT_CURSOR_PREFETCH rows.
+        """
+        await self.flush_events(app_name=app_name, user_id=user_id, session_id=session_id)
+        config = config or GetSessionConfig()
+        async with self.pool.acquire() as conn:
+            query, args = self._events_query(app_name, user_id, session_id, config)
+            async with conn.transaction():
+                async for row in conn.cursor(query, *args, prefetch=EVENT_CURSOR_PREFETCH):
+                    yield Event.model_validate_json(row['event'])
+
+    @staticmethod
+    def _events_query(
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: GetSessionConfig,
+    ) -> tuple[str, tuple]:
+        """Selects the event query and its arguments for a session config."""
+        if config.after_timestamp is None:
+            return SQL_STATEMENTS['get_session_events'], (app_name, user_id, session_id, config.num_recent_events)
+        return (
+            SQL_STATEMENTS['get_session_events_after'],
+            (app_name, user_id, session_id, config.after_timestamp, config.num_recent_events),
+        )
+
     async def add_event(
         self,
         *,
@@ -165,49 +434,45 @@ class PostgresSessionService(BaseSessionService):
         session_id: str,
         event: Event
     ) -> None:
-        """Adds an event to the database."""
+        """
+        Buffers an event for insertion into the database.
+
+        Events are written in batches by a background task; call flush_events()
+        to wait for them to be persisted. Callers should only forward finalized
+        events: partial (streamed) events are never persisted and are dropped here.
+        """
         if event.partial:
             return
-        sql = """
-            INSERT INTO events (app_name, user_id, session_id, timestamp, event)
-            VALUES ($1, $2, $3, $4, $5);
-        """
-        async with self.pool.acquire() as conn:
-            await conn.execute(sql, app_name, user_id, session_id, event.timestamp, json.dumps(event.dict()))
+        # Fragment embeds the already-serialized JSON as-is when the codec encodes it
+        self._event_queue.put_nowait(
+            (app_name, user_id, session_id, event.timestamp, orjson.Fragment(event.model_dump_json()))
+        )
 
     async def update_session(self, session: Session, *, app_name: str, user_id: str):
         """Saves or updates a session's state in the database using an UPSERT operation."""
-        sql = """
-            INSERT INTO sessions (app_name, user_id, session_id, state)
-            VALUES ($1, $2, $3, $4)
-            ON CONFLICT (app_name, user_id, session_id)
-            DO UPDATE SET state = EXCLUDED.state;
-        """
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                sql, app_name, user_id, session.session_id, json.dumps(session.state)
-            )
+        async with self._connection() as conn:
+            await conn.execute(SQL_STATEMENTS['update_session'], app_name, user_id, session.session_id, session.state)
 
     async def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
         """Lists all sessions for a given app and user."""
-        sql = """
-            SELECT session_id FROM sessions
-            WHERE app_name = $1 AND user_id = $2;
-        """
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch(sql, app_name, user_id)
-        
+        async with self._connection() as conn:
+            rows = await conn.fetch(SQL_STATEMENTS['list_sessions'], app_name, user_id)
+
+        # Rows come straight from our own table, so skip per-row validation.
+        # model_construct drops unknown fields, so the ADK field names must be used.
         sessions = [
-            Session(session_id=row['session_id'])
+            Session.model_construct(id=row['session_id'], app_name=app_name, user_id=user_id)
             for row in rows
         ]
-        return ListSessionsResponse(sessions=sessions)
+        return ListSessionsResponse.model_construct(sessions=sessions)
 
     async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
         """Deletes a session from the database."""
-        async with self.pool.acquire() as conn:
-            sql_events = "DELETE FROM events WHERE app_name = $1 AND user_id = $2 AND session_id = $3;"
-            await conn.execute(sql_events, app_name, user_id, session_id)
-            sql = "DELETE FROM sessions WHERE app_name = $1 AND user_id = $2 AND session_id = $3;"
-            await conn.execute(sql, app_name, user_id, session_id)
+        await self._drain_events()
+        # Events that could not be written would be deleted with the session anyway
+        key = (app_name, user_id, session_id)
+        self._failed_events = [(record, error) for record, error in self._failed_events if record[:3] != key]
+        async with self._connection() as conn:
+            # The session's events are removed by the foreign key's ON DELETE CASCADE
+            await conn.execute(SQL_STATEMENTS['delete_session'], app_name, user_id, session_id)
         print(f"Session '{session_id}' deleted.")
\ No newline at end of file
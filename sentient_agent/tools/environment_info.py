@@ -1,15 +1,123 @@
+import functools
+import json
+import logging
+import os
 import platform
-import shutil
+from types import MappingProxyType
 from google.adk.tools import ToolContext
 
+logger = logging.getLogger(__name__)
+
+# The running OS never changes within a process
+OS_NAME = platform.system().lower()
+
+# Package managers to look for on each OS, in order of preference,
+# as (executable, reported name) pairs
+PKG_MANAGER_CANDIDATES = {
+    "linux": (("apt-get", "apt"), ("yum", "yum"), ("dnf", "dnf")),
+    "darwin": (("brew", "brew"),),
+    "windows": (("choco", "choco"), ("winget", "winget")),
+}
+
+# Detected environment persisted across process startups
+CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "sentient_agent",
+    "environment.json",
+)
+
+@functools.lru_cache(maxsize=1)
+def _path_executables() -> frozenset:
+    """
+    Returns the names of all executable files in the directories on PATH.
+
+    One os.scandir per PATH directory replaces the per-candidate, per-directory
+    stat calls that repeated shutil.which lookups would make.
+    """
+    names = set()
+    windows = os.name == "nt"
+    pathext = {ext.lower() for ext in os.environ.get("PATHEXT", "").split(os.pathsep) if ext}
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        try:
+            with os.scandir(directory or ".") as entries:
+                for entry in entries:
+                    if windows:
+                        name = entry.name.lower()
+                        stem, ext = os.path.splitext(name)
+                        if ext in pathext:
+                            names.add(stem)
+                        names.add(name)
+                    elif entry.name not in names and entry.is_file() and os.access(entry.path, os.X_OK):
+                        names.add(entry.name)
+        except OSError:
+            continue
+    return frozenset(names)
+
+def _is_on_path(name: str) -> bool:
+    """Whether an executable with this name exists on PATH, without a shutil.which walk."""
+    return (name.lower() if os.name == "nt" else name) in _path_executables()
+
+def _load_cached_env(path: str) -> dict | None:
+    """
+    Returns the environment saved by a previous run, if it was detected with
+    the same PATH and its package manager is still there.
+
+    An entry without a package manager is never reused, since one may have
+    been installed into a directory already on PATH.
+    """
+    try:
+        with open(CACHE_FILE, encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("path") != path:
+        return None
+    env_info = cached.get("environment")
+    if not isinstance(env_info, dict) or env_info.get("os") != OS_NAME:
+        return None
+    # e.g. a home directory shared by two distros with the same PATH
+    executables = {name: exe for exe, name in PKG_MANAGER_CANDIDATES.get(OS_NAME, ())}
+    exe = executables.get(env_info.get("pkg_manager"))
+    if exe is None or not _is_on_path(exe):
+        return None
+    return env_info
+
+def _save_cached_env(path: str, env_info: dict) -> None:
+    """Saves the detected environment for later runs; failures are not fatal."""
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, "w", encoding="utf-8") as f:
+            json.dump({"path": path, "environment": env_info}, f)
+    except OSError:
+        pass
+
+@functools.cache
+def _detect_env() -> MappingProxyType:
+    """
+    Detects the OS and package manager once per process.
+
+    Reuses a previous run's detection while it is still valid. The result is
+    read-only because every caller shares it.
+    """
+    search_path = os.environ.get("PATH", "")
+    env_info = _load_cached_env(search_path)
+    if env_info is None:
+        logger.debug("Perception: Environment info not cached. Detecting now...")
+        pkg_manager = next(
+            (name for exe, name in PKG_MANAGER_CANDIDATES.get(OS_NAME, ()) if _is_on_path(exe)),
+            None,
+        )
+        env_info = {'os': OS_NAME, 'pkg_manager': pkg_manager}
+        _save_cached_env(search_path, env_info)
+    return MappingProxyType(env_info)
+
 def get_environment_info(dummy_str:str,tool_context:ToolContext) -> dict:
     """
     Detects the operating system and default package manager.
 
-    This tool is state-aware. It checks if the environment information
-    is already stored in the tool_context state to avoid redundant checks. If not,
-    it detects the OS and package manager, updates the state, and returns
-    the information.
+    Detection runs once per process and is memoized. The tool_context state
+    only receives a copy so the environment persists with the session; its
+    presence there decides whether the result is reported as cached.
 
     Args:
         dummy_str: Any dummy value can be passed.
@@ -17,48 +125,15 @@ def get_environment_info(dummy_str:str,tool_context:ToolContext) -> dict:
     Returns:
         A dictionary containing the environment details.
     """
-    print("Executing tool 'get_environment_info'")
-
-    # 1. MEMORY CHECK: First, check if we already know the environment.
-    if 'environment' in tool_context.state and tool_context.state['environment']:
-        print("Perception: Environment info found in state. Returning cached data.")
-        return {
-            "status": "success",
-            "source": "cache",
-            "data": tool_context.state['environment']
-        }
-
-    # 2. PERCEPTION: If not in memory, detect the environment now.
-    print("Perception: Environment info not in state. Detecting now...")
-    env_info = {}
-    os_name = platform.system().lower()
-    env_info['os'] = os_name
-
-    pkg_manager = None
-    if os_name == "linux":
-        if shutil.which("apt-get"):
-            pkg_manager = "apt"
-        elif shutil.which("yum"):
-            pkg_manager = "yum"
-        elif shutil.which("dnf"):
-            pkg_manager = "dnf"
-    elif os_name == "darwin": # macOS
-        if shutil.which("brew"):
-            pkg_manager = "brew"
-    elif os_name == "windows":
-        if shutil.which("choco"):
-            pkg_manager = "choco"
-        elif shutil.which("winget"):
-            pkg_manager = "winget"
-
-    env_info['pkg_manager'] = pkg_manager
-
-    # 3. STATE UPDATE: Save the findings to the tool_context memory.
-    print(f"State Update: Saving environment info to tool_context state: {env_info}")
-    tool_context.state['environment'] = env_info
+    env_info = dict(_detect_env())
+    source = "cache"
+    if not tool_context.state.get('environment'):
+        # Write-through so the environment is saved with the session
+        tool_context.state['environment'] = env_info
+        source = "discovery"
 
     return {
         "status": "success",
-        "source": "discovery",
+        "source": source,
         "data": env_info
-    }
\ No newline at end of file
+    }
@@ -1,14 +1,35 @@
+import atexit
+import functools
+import logging
+import os
+import re
 import subprocess
+import selectors
 import shlex
 import shutil
+import signal
+import threading
+import time
+import uuid
 from google.adk.sessions import Session
 from google.adk.tools import ToolContext
 from google.adk.auth.auth_schemes import AuthScheme, AuthSchemeType # Required for AuthConfig structure
 from google.adk.auth.auth_tool import AuthConfig
 from google.adk.auth.auth_credential import AuthCredential
 from fastapi.openapi.models import HTTPBearer
+from pydantic import ConfigDict
 from typing import Optional
+from .environment_info import _detect_env, _is_on_path, _path_executables
+
+logger = logging.getLogger(__name__)
+
 PASSWORD_STATE_KEY = "user_sudo_password"
+SUDO_TICKET_STATE_KEY = "sudo_ticket_ts"
+# PID of a sudo run waiting at a confirmation prompt
+PAUSED_RUN_STATE_KEY = "pending_proc_pid"
+# Seconds a sudo authentication is trusted to have left a valid ticket
+# (sudo's default timestamp_timeout is 15 minutes)
+SUDO_TICKET_TTL = 600
 CUSTOM_SUDO_KEY = "cli_sudo_password_prompt" 
 
 
@@ -20,24 +41,438 @@ auth_config_params = {
     "prompt_message": "Please provide the sudo password to execute the command." # Custom field for HIL prompt
 }
 
+class _FrozenAuthConfig(AuthConfig):
+    """An AuthConfig that cannot be mutated, so one instance is safely shared by every call."""
+    model_config = ConfigDict(**AuthConfig.model_config, frozen=True)
+
 # 2. Create the AuthConfig instance (assuming model_config allows extra fields)
-AUTH_CONFIG_INSTANCE = AuthConfig(**auth_config_params)
+AUTH_CONFIG_INSTANCE = _FrozenAuthConfig(**auth_config_params)
+
+# Output is matched as raw bytes and only decoded once, when results are returned.
+# Prompts that mean a command is waiting for a yes/no answer
+CONFIRMATION_PROMPT_RE = re.compile(rb"do you want to continue\?|\[y/n\]", re.IGNORECASE)
+# sudo messages for a rejected password
+AUTH_FAILURE_RE = re.compile(rb"sorry, try again|incorrect password", re.IGNORECASE)
+# Shell (POSIX) and cmd.exe (Windows) messages for an unknown command
+COMMAND_NOT_FOUND_RE = re.compile(rb"command not found|not recognized as", re.IGNORECASE)
+# A leading 'sudo' word, only at the start of the command
+SUDO_PREFIX_RE = re.compile(r"^\s*sudo\s+")
+# Characters that give a command shell semantics (pipes, redirects, globs, chaining, ...)
+SHELL_METACHARS_RE = re.compile(r"[|&;<>*?$`(){}\[\]\\\n'\"]")
+# Side-effect-free probes whose results may be served from the tool run cache
+READ_ONLY_PROBE_RE = re.compile(
+    r"^\s*(?:which\s+\S+|command\s+-v\s+\S+|test\s+-e\s+\S+|ls(?:\s+\S+)*"
+    r"|\S+\s+(?:--version|--help|-V))\s*$"
+)
+
+# sudo reply to -n when its timestamp ticket has expired
+SUDO_PASSWORD_REQUIRED_RE = re.compile(rb"a password is required", re.IGNORECASE)
+
+# Bare program names that are looked up on PATH (no paths or assignments)
+PROGRAM_NAME_RE = re.compile(r"[\w.+-]+")
+# bash builtins and keywords, which run without any executable on PATH
+SHELL_BUILTINS = frozenset(
+    "alias bg bind break builtin caller cd command compgen complete compopt continue "
+    "declare dirs disown echo enable eval exec exit export false fc fg getopts hash "
+    "help history jobs kill let local logout mapfile popd printf pushd pwd read "
+    "readarray readonly return set shift shopt source suspend test times trap true "
+    "type typeset ulimit umask unalias unset wait if then else elif fi case esac for "
+    "select while until do done function time .".split()
+)
+# Commands that may change PATH or define functions inside the worker shell:
+# PATH assignments, function definitions, and sourcing a file
+WORKER_ENV_CHANGE_RE = re.compile(
+    r"\bPATH\+?="
+    r"|\bfunction\s+[\w.:-]+|[\w.:-]+\s*\(\s*\)\s*[{(]"
+    r"|(?:^|[;&|(])\s*(?:source|\.)\s"
+)
+
+# Most commands remembered in state['commands'], oldest entries dropped first
+COMMANDS_CACHE_SIZE = 256
+# Bumped whenever installed software may have changed; older negative entries are stale
+PATH_GEN_STATE_KEY = "path_gen"
+
+# Seconds a command learned to be missing is reported without running it again
+MISSING_COMMAND_TTL = 300
+
+TOOL_RUN_CACHE_SIZE = 64
+
+# Absolute shell path: CPython only launches children with posix_spawn (instead
+# of fork + exec) when the program path is absolute and close_fds=False, with no
+# preexec_fn, cwd or restore_signals=False. Our fds are non-inheritable by default.
+SHELL_PATH = shutil.which("bash") or "/bin/sh"
+
+# Seconds a one-off child process may run before it is killed
+COMMAND_TIMEOUT = 600
+
+# Most sessions with a live shell worker; the least recently used is killed
+MAX_SHELL_WORKERS = 8
+# Seconds to wait for a worker whose output pipes closed to exit
+WORKER_EXIT_GRACE = 1
+
+# Bytes read from a worker pipe per os.read call
+WORKER_READ_SIZE = 1 << 16
+# Bytes of each output stream kept for a streamed sudo run
+OUTPUT_LIMIT = 1 << 20
+# Bytes of recent output searched for a confirmation prompt
+PROMPT_WINDOW = 256
+# Seconds of silence after which a sudo run that showed no prompt gets EOF on
+# stdin, so commands reading their input (sudo tee, sudo mysql) do not hang
+PROMPT_IDLE_TIMEOUT = 5
+
+
+class _ShellWorker:
+    """
+    A long-lived bash process that runs commands written to its stdin.
+
+    Each command is followed by a unique sentinel on stdout and stderr, so its
+    output and exit code can be read back without spawning a new shell.
+
+    Background jobs share the worker's pipes. Output they print between
+    commands is discarded before the next command runs, but output printed
+    while a later command is running ends up in that command's result.
+    """
+
+    def __init__(self):
+        self._sentinel = f"__SENTINEL_{uuid.uuid4().hex}__".encode()
+        self._lock = threading.Lock()
+        # Cleared once a command may have changed this shell's PATH; from then
+        # on missing programs are left for the shell to report
+        self.path_trusted = True
+        self.process = subprocess.Popen(
+            [SHELL_PATH, "-s"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+            close_fds=False,
+            # Its own process group lets a timeout kill the running command and
+            # any background jobs with it. This rules out posix_spawn, but a
+            # worker is only started once and then reused.
+            process_group=0,
+        )
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self) -> None:
+        """Kills the worker's whole process group; the next call gets a fresh worker."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            pipe.close()
+
+    def run(self, command: str) -> tuple[int, bytes, bytes]:
+        """
+        Runs a command in the worker and returns its exit code, stdout and stderr.
+
+        Raises:
+            subprocess.TimeoutExpired: If the command does not finish within
+                COMMAND_TIMEOUT seconds; the worker is killed.
+        """
+        sentinel = self._sentinel.decode()
+        # eval keeps a malformed command from swallowing the sentinel lines, and
+        # stdin is detached so the command cannot read the rest of the script
+        script = (
+            f"eval {shlex.quote(command)} </dev/null\n"
+            f"printf '\\n{sentinel}%d\\n' $?\n"
+            f"printf '\\n{sentinel}\\n' >&2\n"
+        )
+        with self._lock:
+            self._discard_stale_output()
+            data = memoryview(script.encode())
+            while data:
+                data = data[self.process.stdin.write(data):]
+            return self._read_result(command)
+
+    def _discard_stale_output(self) -> None:
+        """Drops output background jobs printed since the last command finished."""
+        with selectors.DefaultSelector() as selector:
+            for pipe in (self.process.stdout, self.process.stderr):
+                selector.register(pipe, selectors.EVENT_READ)
+            while events := selector.select(0):
+                for key, _ in events:
+                    chunk = os.read(key.fileobj.fileno(), WORKER_READ_SIZE)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                    logger.debug("Discarding %d bytes of background job output", len(chunk))
+
+    def _read_result(self, command: str) -> tuple[int, bytes, bytes]:
+        sentinel = self._sentinel
+        buffers = {self.process.stdout: bytearray(), self.process.stderr: bytearray()}
+        marker_at = {}
+        deadline = time.monotonic() + COMMAND_TIMEOUT
+        with selectors.DefaultSelector() as selector:
+            for pipe in buffers:
+                selector.register(pipe, selectors.EVENT_READ)
+            while len(marker_at) < len(buffers):
+                remaining = deadline - time.monotonic()
+                events = selector.select(remaining) if remaining > 0 else []
+                if not events:
+                    # Also covers commands that redirect the shell's own output
+                    # (e.g. `exec >file`), whose sentinel never arrives
+                    self.kill()
+                    raise subprocess.TimeoutExpired(command, COMMAND_TIMEOUT)
+                for key, _ in events:
+                    pipe = key.fileobj
+                    chunk = os.read(pipe.fileno(), WORKER_READ_SIZE)
+                    if not chunk:
+                        # The command ended the shell (e.g. `exit`); report its exit status
+                        selector.unregister(pipe)
+                        marker_at[pipe] = len(buffers[pipe])
+                        continue
+                    buffer = buffers[pipe]
+                    search_from = max(0, len(buffer) - len(sentinel))
+                    buffer += chunk
+                    index = buffer.find(sentinel, search_from)
+                    if index != -1:
+                        selector.unregister(pipe)
+                        # Drop the newline printed ahead of the sentinel
+                        marker_at[pipe] = index - 1
+
+        stdout_buffer, stderr_buffer = buffers[self.process.stdout], buffers[self.process.stderr]
+        stdout_end, stderr_end = marker_at[self.process.stdout], marker_at[self.process.stderr]
+        if stdout_end < len(stdout_buffer):
+            returncode = int(stdout_buffer[stdout_end + 1 + len(sentinel):].strip())
+        else:
+            try:
+                returncode = self.process.wait(timeout=WORKER_EXIT_GRACE)
+            except subprocess.TimeoutExpired:
+                # The shell is alive but closed its output (e.g. `exec >file`),
+                # so this worker can no longer report results
+                self.kill()
+                returncode = self.process.returncode
+        return returncode, bytes(stdout_buffer[:stdout_end]), bytes(stderr_buffer[:stderr_end])
+
+
+class _StreamingRun:
+    """
+    A one-off command whose stdin stays open while its output is streamed.
+
+    Reading can stop as soon as the command shows a confirmation prompt or
+    sudo rejects the password, instead of only once the process exits. Only
+    the last OUTPUT_LIMIT bytes of each stream are kept.
+    """
+
+    def __init__(self, args: list[str], input_bytes: bytes | None = None):
+        self.process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+            close_fds=False,
+        )
+        self._output = {self.process.stdout: bytearray(), self.process.stderr: bytearray()}
+        # Recent output that prompts are matched against
+        self._tails = {pipe: bytearray() for pipe in self._output}
+        self._open = set(self._output)
+        if input_bytes:
+            self.send(input_bytes)
+
+    def send(self, data: bytes) -> None:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[self.process.stdin.write(view):]
+        except BrokenPipeError:
+            pass # The command exited without reading its input
+
+    def close_stdin(self) -> None:
+        if not self.process.stdin.closed:
+            self.process.stdin.close()
+
+    def read(self, timeout: float, stop_early: bool = True, idle_timeout: float | None = None) -> str:
+        """
+        Streams output until the command exits or, if stop_early, until it waits
+        at a confirmation prompt or sudo rejects the password.
+
+        With idle_timeout, also stops once the command has been silent that long.
+
+        Returns:
+            'exited', 'prompt', 'auth_failed' or 'idle'.
+        """
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            for pipe in self._open:
+                selector.register(pipe, selectors.EVENT_READ)
+            while self._open:
+                remaining = deadline - time.monotonic()
+                wait = remaining if idle_timeout is None else min(remaining, idle_timeout)
+                events = selector.select(wait) if remaining > 0 else []
+                if not events and time.monotonic() < deadline:
+                    return "idle"
+                if not events:
+                    self.kill()
+                    raise subprocess.TimeoutExpired(self.process.args, timeout)
+                for key, _ in events:
+                    pipe = key.fileobj
+                    chunk = os.read(pipe.fileno(), WORKER_READ_SIZE)
+                    if not chunk:
+                        selector.unregister(pipe)
+                        self._open.discard(pipe)
+                        continue
+                    buffer = self._output[pipe]
+                    buffer += chunk
+                    if len(buffer) > 2 * OUTPUT_LIMIT:
+                        del buffer[:-OUTPUT_LIMIT]
+                    tail = self._tails[pipe]
+                    tail += chunk
+                    del tail[:-PROMPT_WINDOW]
+                    if not stop_early:
+                        continue
+                    if pipe is self.process.stderr and AUTH_FAILURE_RE.search(tail):
+                        return "auth_failed"
+                    if CONFIRMATION_PROMPT_RE.search(tail):
+                        tail.clear()
+                        return "prompt"
+        self.process.wait()
+        return "exited"
+
+    def kill(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.close()
+
+    def close(self) -> None:
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            pipe.close()
+
+    def output(self) -> tuple[bytes, bytes]:
+        """Returns the stdout/stderr kept so far."""
+        return (
+            bytes(self._output[self.process.stdout][-OUTPUT_LIMIT:]),
+            bytes(self._output[self.process.stderr][-OUTPUT_LIMIT:]),
+        )
+
+    def result(self) -> tuple[int, bytes, bytes]:
+        """Returns the exit code and kept stdout/stderr of a command that has exited."""
+        self.close()
+        return (self.process.returncode, *self.output())
+
+
+# Sudo runs waiting at a confirmation prompt, keyed by PID. Live processes
+# cannot go into the JSON session state, so state only records the PID; a
+# strong reference is needed because nothing else keeps the run alive.
+_paused_runs: dict[int, _StreamingRun] = {}
+
+def _reap_paused_runs() -> None:
+    """Answers every paused run's prompt with EOF at exit so none outlive the agent."""
+    while _paused_runs:
+        _, run = _paused_runs.popitem()
+        run.close_stdin()
+        try:
+            run.read(WORKER_EXIT_GRACE, stop_early=False)
+        except subprocess.TimeoutExpired:
+            pass # Already killed
+
+atexit.register(_reap_paused_runs)
+
+
+# Results of read-only probes by command, as (monotonic time, result), least
+# recently used first. Kept out of session state: entries live for seconds,
+# describe this machine rather than one session, and would otherwise be
+# persisted with every event that touched them.
+_tool_run_cache: dict[str, tuple[float, dict]] = {}
+_tool_run_cache_lock = threading.Lock()
+
+
+# Shell workers by session id, least recently used first, so one session's
+# cd, export or set -e never affects another's commands. A pre-started spare
+# means a new or replaced worker never waits on a fresh bash startup.
+_workers: dict[str, _ShellWorker] = {}
+_spare_workers: list[_ShellWorker] = []
+_workers_lock = threading.Lock()
+
+
+def _get_shell_worker(session_id: str) -> _ShellWorker | None:
+    """Returns the session's live shell worker, or None where persistent workers are unsupported."""
+    if os.name != "posix":
+        return None
+    with _workers_lock:
+        worker = _workers.pop(session_id, None)
+        if worker is None or not worker.alive():
+            spare = _spare_workers.pop() if _spare_workers else None
+            worker = spare if spare is not None and spare.alive() else _ShellWorker()
+        _workers[session_id] = worker
+        while len(_workers) > MAX_SHELL_WORKERS:
+            _workers.pop(next(iter(_workers))).kill()
+        if not _spare_workers:
+            _spare_workers.append(_ShellWorker())
+        return worker
+
+def _session_id(tool_context: ToolContext) -> str:
+    return tool_context._invocation_context.session.id
+
+def _is_read_only_probe(command: str) -> bool:
+    return READ_ONLY_PROBE_RE.match(command) is not None and not SHELL_METACHARS_RE.search(command)
+
+def _invalidate_tool_run_cache() -> None:
+    with _tool_run_cache_lock:
+        _tool_run_cache.clear()
+
+def _cached_tool(ttl: float = 60):
+    """
+    Serves repeated read-only probes (e.g. `git --version`, `which apt`) from
+    a process-local cache instead of running them again.
+
+    Only successful and CommandNotInstalled results are cached. Any other
+    command may change what a probe would report, so it clears the cache.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(command: str, tool_context: ToolContext) -> dict:
+            if not _is_read_only_probe(command):
+                _invalidate_tool_run_cache()
+                return func(command, tool_context)
+
+            key = command.strip()
+            with _tool_run_cache_lock:
+                entry = _tool_run_cache.pop(key, None)
+                if entry is not None and time.monotonic() - entry[0] < ttl:
+                    # Re-insert to keep the most recently used entries last
+                    _tool_run_cache[key] = entry
+                    return dict(entry[1])
+
+            result = func(command, tool_context)
+            if result.get("status") == "success" or result.get("reason") == "CommandNotInstalled":
+                with _tool_run_cache_lock:
+                    _tool_run_cache[key] = (time.monotonic(), dict(result))
+                    while len(_tool_run_cache) > TOOL_RUN_CACHE_SIZE:
+                        del _tool_run_cache[next(iter(_tool_run_cache))]
+            return result
+        return wrapper
+    return decorator
 
 def execute_shell_command(command: str, tool_context: ToolContext) -> dict:
     """
     Executes a shell command, handling both sudo password prompts (authentication)
     and interactive confirmations (e.g., 'Y/n').
     """
-    print(f"\n[TOOL] Executing 'execute_shell_command' with input: '{command}'")
+    logger.debug("[TOOL] Executing 'execute_shell_command' with input: '%s'", command)
 
     if 'commands' not in tool_context.state:
         tool_context.state['commands'] = {}
 
+    # The first command of a session also reports the environment, which saves
+    # the agent a separate get_environment_info round trip. Detection is
+    # memoized per process, so this spawns nothing.
+    env_info = None
+    if not tool_context.state.get('environment'):
+        env_info = tool_context.state['environment'] = dict(_detect_env())
+
+    is_sudo = command.strip().startswith("sudo")
+    if not (is_sudo and tool_context.tool_confirmation is not None):
+        # Only the confirmation resume answers a paused run; any other call abandons it
+        _discard_paused_run(tool_context)
+
     # --- MAIN LOGIC BRANCH: SUDO vs. NON-SUDO ---
-    if command.strip().startswith("sudo"):
-        return _handle_sudo_command(command, tool_context)
+    if is_sudo:
+        _invalidate_tool_run_cache()
+        result = _handle_sudo_command(command, tool_context)
     else:
-        return _handle_standard_command(command, tool_context)
+        result = _handle_standard_command(command, tool_context)
+    if env_info is not None:
+        result = {**result, "environment": env_info}
+    return result
 
 def _handle_sudo_command(command: str, tool_context: ToolContext) -> dict:
     """Handles the complex logic for sudo commands, including auth and confirmation."""
@@ -45,14 +480,21 @@ def _handle_sudo_command(command: str, tool_context: ToolContext) -> dict:
     # --- Part 1: Handle Resuming from a Confirmation Prompt ---
     if tool_context.tool_confirmation is not None:
         if not tool_context.tool_confirmation.confirmed:
+            _discard_paused_run(tool_context)
             return {"status": "rejected", "details": "User rejected the confirmation prompt."}
         
-        # User confirmed 'Y'. Get the original command from the payload and re-run with 'y'.
+        # User confirmed 'Y'. Answer the paused run, or re-run the original command with 'y'.
         original_command = tool_context.tool_confirmation.payload.get('command_to_confirm', command)
         password = tool_context.state.get(PASSWORD_STATE_KEY)
         if not password:
+             _discard_paused_run(tool_context)
              return {"status": "error", "reason": "StateError", "details": "Password was lost after confirmation."}
-        return _run_subprocess(original_command, password=password, tool_context=tool_context, confirmation_input='y\n')
+        result = _run_subprocess(
+            original_command, password=password, tool_context=tool_context,
+            confirmation_input='y\n', paused_run=_take_paused_run(tool_context),
+        )
+        # A resumed run may stop at a further prompt
+        return _request_confirmation_if_prompted(result, original_command, tool_context)
 
     # --- Part 2: Handle Authentication (Password Check) ---
     password = None
@@ -66,23 +508,16 @@ def _handle_sudo_command(command: str, tool_context: ToolContext) -> dict:
         password = tool_context.state.get(PASSWORD_STATE_KEY) # Use cached password
 
     if not password:
-        print("[TOOL] Sudo command requires password. Pausing for authentication.")
+        logger.debug("[TOOL] Sudo command requires password. Pausing for authentication.")
         tool_context.request_credential(AUTH_CONFIG_INSTANCE)
         return {"status": "pending_auth", "details": "Awaiting sudo password."}
 
     # --- Part 3: Initial Execution and Check for Confirmation Prompt ---
     result = _run_subprocess(command, password=password,tool_context=tool_context)
 
-    # Check if the command output is asking for a Y/n confirmation
-    output_text = result.get('stdout', '') + result.get('stderr', '')
-    confirmation_phrases = ["do you want to continue?", "[y/n]", "is this ok? [y/n]"]
-    if any(phrase in output_text.lower() for phrase in confirmation_phrases):
-        print("[TOOL] Command requires user confirmation. Pausing.")
-        tool_context.request_confirmation(
-            hint=f"The command is asking for confirmation:\n---\n{output_text}\n---\nPlease respond with 'y' or 'n'.",
-            payload={'command_to_confirm': command} # Pass the command along for the resume step
-        )
-        return {"status": "pending_confirmation", "details": "Awaiting user confirmation (Y/n)."}
+    result = _request_confirmation_if_prompted(result, command, tool_context)
+    if result.get("status") == "pending_confirmation":
+        return result
 
     # If auth failed, clear password and re-request
     if result.get("reason") == "AuthenticationFailed":
@@ -93,46 +528,278 @@ def _handle_sudo_command(command: str, tool_context: ToolContext) -> dict:
 
     return result
 
+def _remember_command(tool_context: ToolContext, base_command: str, installed: bool) -> None:
+    """
+    Records whether a command is installed in the capped state['commands'] map.
+    Negative entries carry the time and PATH generation they were learned in.
+
+    State is only written when the entry changes, since each write puts the
+    whole map into the event's state delta.
+    """
+    gen = tool_context.state.get(PATH_GEN_STATE_KEY, 0)
+    commands = tool_context.state.get('commands') or {}
+    known = commands.get(base_command)
+    if known is not None and known.get('installed') is installed and (
+        installed
+        or (known.get('gen', 0) == gen and time.time() - known.get('ts', 0) < MISSING_COMMAND_TTL)
+    ):
+        return
+    commands = dict(commands)
+    commands.pop(base_command, None)
+    info = {'installed': installed}
+    if not installed:
+        info.update(ts=time.time(), gen=gen)
+    commands[base_command] = info
+    while len(commands) > COMMANDS_CACHE_SIZE:
+        del commands[next(iter(commands))]
+    # Reassign so the state change is recorded and persisted
+    tool_context.state['commands'] = commands
+
+def _bump_path_generation(tool_context: ToolContext) -> None:
+    """Marks every 'not installed' entry as stale, e.g. after a command may have installed them."""
+    tool_context.state[PATH_GEN_STATE_KEY] = tool_context.state.get(PATH_GEN_STATE_KEY, 0) + 1
+    _path_executables.cache_clear()
+    # The package manager itself may have just been installed
+    _detect_env.cache_clear()
+
+def _request_confirmation_if_prompted(result: dict, command: str, tool_context: ToolContext) -> dict:
+    """Pauses for user confirmation when the command output is asking for a Y/n answer."""
+    if result.pop('awaiting_confirmation', False):
+        output_text = result.get('stdout', '') + result.get('stderr', '')
+        logger.debug("[TOOL] Command requires user confirmation. Pausing.")
+        tool_context.request_confirmation(
+            hint=f"The command is asking for confirmation:\n---\n{output_text}\n---\nPlease respond with 'y' or 'n'.",
+            payload={'command_to_confirm': command} # Pass the command along for the resume step
+        )
+        return {"status": "pending_confirmation", "details": "Awaiting user confirmation (Y/n)."}
+    return result
+
+@_cached_tool(ttl=60)
 def _handle_standard_command(command: str, tool_context: ToolContext) -> dict:
     """Handles non-sudo commands with the robust 'act-first, then-learn' logic."""
-    return _run_subprocess(command, tool_context=tool_context)
+    # Commands learned to be missing are not run again until the entry expires
+    head = command.split(None, 1)
+    base_command = head[0] if head else ""
+    known = tool_context.state['commands'].get(base_command)
+    if (
+        known and known.get('installed') is False
+        and known.get('gen', 0) == tool_context.state.get(PATH_GEN_STATE_KEY, 0)
+        and time.time() - known.get('ts', 0) < MISSING_COMMAND_TTL
+        and not _is_on_path(base_command)
+    ):
+        return {"status": "error", "reason": "CommandNotInstalled", "details": f"{base_command} is known to be missing (cached)"}
+    worker = _get_shell_worker(_session_id(tool_context))
+    if WORKER_ENV_CHANGE_RE.search(command):
+        # The worker shell's PATH or functions may no longer match what we indexed,
+        # and commands learned to be missing may now resolve
+        if worker is not None:
+            worker.path_trusted = False
+        _bump_path_generation(tool_context)
+    elif _is_missing_program(base_command, worker):
+        _remember_command(tool_context, base_command, installed=False)
+        return {"status": "error", "reason": "CommandNotInstalled", "details": f"{base_command} was not found on PATH"}
+    result = _run_subprocess(command, tool_context=tool_context)
+    if "install" in command.lower():
+        # pip/npm/cargo/brew installs need no sudo but can provide missing commands
+        _bump_path_generation(tool_context)
+    return result
 
-def _run_subprocess(command: str, tool_context: ToolContext, password: str | None = None, confirmation_input: str | None = None) -> dict:
-    """A centralized function for running subprocess commands."""
+def _is_missing_program(name: str, worker: _ShellWorker | None) -> bool:
+    """
+    Whether a command word is a plain program name that is not on the worker's PATH.
+
+    Paths, assignments, shell builtins and keywords are never reported missing,
+    nor is anything once the worker's PATH may differ from ours.
+    """
+    if not (
+        worker is not None
+        and worker.path_trusted
+        and PROGRAM_NAME_RE.fullmatch(name) is not None
+        and name not in SHELL_BUILTINS
+    ):
+        return False
+    if _is_on_path(name):
+        return False
+    # The index may predate an install that did not go through sudo (pip --user,
+    # npm -g, cargo, a copy into ~/.local/bin), so re-scan PATH before a miss
+    _path_executables.cache_clear()
+    return not _is_on_path(name)
+
+def _direct_argv(command: str) -> list[str] | None:
+    """
+    Returns the argv to exec a command without a shell, or None when it needs one.
+
+    Commands using shell syntax, shell builtins and unknown programs are left
+    to the shell, so its usual 'command not found' reporting still applies.
+    """
+    if SHELL_METACHARS_RE.search(command):
+        return None
+    argv = shlex.split(command)
+    program = shutil.which(argv[0]) if argv else None
+    if program is None:
+        return None
+    # An absolute program path keeps CPython on its posix_spawn fast path
+    argv[0] = program
+    return argv
+
+def _spawn(args, input_bytes: bytes | None = None, **popen_kwargs) -> tuple[int, bytes, bytes]:
+    """Runs one child process to completion, killing it after COMMAND_TIMEOUT seconds."""
+    stdin = subprocess.PIPE if input_bytes is not None else None
+    with subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs) as process:
+        try:
+            stdout, stderr = process.communicate(input_bytes, timeout=COMMAND_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+    return process.returncode, stdout, stderr
+
+def _execute(command_to_run: str, input_bytes: bytes | None = None, session_id: str | None = None) -> tuple[int, bytes, bytes]:
+    """
+    Runs a command line and returns its exit code and raw stdout/stderr.
+
+    With a session_id, commands without input run in that session's shell worker.
+    """
+    if session_id is not None and input_bytes is None:
+        worker = _get_shell_worker(session_id)
+        if worker is not None:
+            return worker.run(command_to_run)
+        # Without a worker, spawn plain commands directly instead of through a shell
+        argv = _direct_argv(command_to_run)
+        if argv is not None:
+            return _spawn(argv, close_fds=os.name != "posix")
+    if os.name == "posix":
+        # Explicit argv instead of shell=True so the posix_spawn fast path applies
+        return _spawn([SHELL_PATH, "-c", command_to_run], input_bytes, close_fds=False)
+    return _spawn(command_to_run, input_bytes, shell=True)
+
+def _execute_sudo(command_to_run: str, input_bytes: bytes | None, wait_for_prompt: bool) -> tuple[int | None, bytes, bytes, "_StreamingRun | None"]:
+    """
+    Runs a sudo command line and returns its exit code, stdout and stderr.
+
+    With wait_for_prompt, stdin stays open after input_bytes so a confirmation
+    prompt is seen as soon as it is printed, until the command has been silent
+    for PROMPT_IDLE_TIMEOUT seconds. The command is then left running
+    at its prompt: the exit code is None and the paused run is returned as the
+    fourth element, to be answered with _drive_sudo_run later.
+    """
+    if os.name != "posix":
+        # Pipes cannot be polled here; buffer the whole run
+        return (*_execute(command_to_run, input_bytes), None)
+    # Plain sudo commands are exec'd directly; only shell syntax needs a shell
+    args = _direct_argv(command_to_run) or [SHELL_PATH, "-c", command_to_run]
+    return _drive_sudo_run(_StreamingRun(args, input_bytes), wait_for_prompt)
+
+def _drive_sudo_run(run: _StreamingRun, wait_for_prompt: bool) -> tuple[int | None, bytes, bytes, _StreamingRun | None]:
+    """Reads a streamed sudo run until it exits or, if wait_for_prompt, pauses at a prompt."""
     try:
-        command_to_run = command
-        process_input = confirmation_input
+        stopped_at = run.read(COMMAND_TIMEOUT, idle_timeout=PROMPT_IDLE_TIMEOUT) if wait_for_prompt else "exited"
+        if stopped_at == "prompt":
+            return (None, *run.output(), run)
+        # No prompt to answer; EOF ends commands that were waiting on stdin
+        run.close_stdin()
+        # Let the command finish on EOF; a no-op if it already exited
+        run.read(COMMAND_TIMEOUT, stop_early=False)
+    except BaseException:
+        run.kill()
+        raise
+    return (*run.result(), None)
 
-        if password:
-            # Use 'sudo -S' to read password from stdin
-            command_to_run = f"sudo -S {command.strip().replace('sudo', '', 1).strip()}"
-            process_input = password + '\n'
-            # If we also have a confirmation, chain them
-            if confirmation_input:
-                process_input += confirmation_input
-        
-        process = subprocess.run(
-            command_to_run, shell=True, capture_output=True, text=True,
-            input=process_input, check=False
-        )
-        stdout, stderr = process.stdout.strip(), process.stderr.strip()
+def _take_paused_run(tool_context: ToolContext) -> _StreamingRun | None:
+    """Returns the session's run still waiting at a confirmation prompt, if it is alive."""
+    pid = tool_context.state.get(PAUSED_RUN_STATE_KEY)
+    if pid is None:
+        return None
+    tool_context.state[PAUSED_RUN_STATE_KEY] = None
+    run = _paused_runs.pop(pid, None)
+    if run is not None and run.process.poll() is not None:
+        # It exited while we waited; the caller runs the command again
+        run.kill()
+        return None
+    return run
+
+def _discard_paused_run(tool_context: ToolContext) -> None:
+    """Answers a paused run's prompt with EOF so it aborts, and waits for it to exit."""
+    run = _take_paused_run(tool_context)
+    if run is not None:
+        try:
+            _drive_sudo_run(run, wait_for_prompt=False)
+        except subprocess.TimeoutExpired:
+            pass # Already killed
+
+def _sudo_ticket_valid(tool_context: ToolContext) -> bool:
+    """Whether a recent sudo authentication should still have a valid timestamp ticket."""
+    ticket_ts = tool_context.state.get(SUDO_TICKET_STATE_KEY)
+    return ticket_ts is not None and time.time() - ticket_ts < SUDO_TICKET_TTL
+
+def _run_subprocess(command: str, tool_context: ToolContext, password: str | None = None, confirmation_input: str | None = None, paused_run: _StreamingRun | None = None) -> dict:
+    """A centralized function for running subprocess commands."""
+    try:
+        # Child processes are fed bytes, encoded once here
+        confirmation_bytes = confirmation_input.encode() if confirmation_input is not None else None
+        # A first sudo run may stop at a Y/n prompt; the caller pauses for confirmation
+        wait_for_prompt = confirmation_input is None
+        if paused_run is not None:
+            # Answer the prompt the command is still waiting at, instead of running it again
+            paused_run.send(confirmation_bytes)
+            returncode, stdout, stderr, paused_run = _drive_sudo_run(paused_run, wait_for_prompt=True)
+        elif password:
+            sudo_args = SUDO_PREFIX_RE.sub('', command, count=1).strip()
+            ticket_rejected = True
+            if _sudo_ticket_valid(tool_context):
+                # 'sudo -n' reuses the cached ticket and never reads a password
+                returncode, stdout, stderr, paused_run = _execute_sudo(f"sudo -n {sudo_args}", confirmation_bytes, wait_for_prompt)
+                ticket_rejected = returncode not in (0, None) and SUDO_PASSWORD_REQUIRED_RE.search(stderr)
+            if ticket_rejected:
+                # Use 'sudo -S' to read password from stdin, chaining any confirmation after it
+                process_input = password.encode() + b'\n' + (confirmation_bytes or b'')
+                returncode, stdout, stderr, paused_run = _execute_sudo(f"sudo -S {sudo_args}", process_input, wait_for_prompt)
+        else:
+            returncode, stdout, stderr = _execute(command, confirmation_bytes, session_id=_session_id(tool_context))
+        stdout, stderr = stdout.strip(), stderr.strip()
 
         # Sudo auth failure check
-        if password and ("sorry, try again" in stderr.lower() or "incorrect password" in stderr.lower()):
-            return {"status": "error", "reason": "AuthenticationFailed"}
+        if password:
+            if AUTH_FAILURE_RE.search(stderr):
+                tool_context.state[SUDO_TICKET_STATE_KEY] = None
+                return {"status": "error", "reason": "AuthenticationFailed"}
+            # sudo accepted us, so its timestamp ticket is fresh
+            tool_context.state[SUDO_TICKET_STATE_KEY] = time.time()
+            if paused_run is not None:
+                # Keep the command waiting at its prompt until the user answers
+                _paused_runs[paused_run.process.pid] = paused_run
+                tool_context.state[PAUSED_RUN_STATE_KEY] = paused_run.process.pid
+                return {
+                    "status": "pending", "stdout": stdout.decode(errors="replace"),
+                    "stderr": stderr.decode(errors="replace"), "awaiting_confirmation": True,
+                }
+            if returncode == 0:
+                # The command may have installed packages or extended PATH
+                _bump_path_generation(tool_context)
 
         # Standard command success/failure learning logic
-        base_command = shlex.split(command)[0]
-        if process.returncode == 0:
-            tool_context.state['commands'][base_command] = {'installed': True}
-            return {"status": "success", "stdout": stdout, "stderr": stderr}
-        elif 'command not found' in stderr.lower() or 'not recognized as' in stderr.lower():
-            tool_context.state['commands'][base_command] = {'installed': False}
+        # Only the first word is needed, so avoid a full shlex parse of the command
+        head = command.split(None, 1)
+        base_command = head[0] if head else ""
+        if returncode == 0:
+            _remember_command(tool_context, base_command, installed=True)
+            result = {"status": "success", "stdout": stdout.decode(errors="replace"), "stderr": stderr.decode(errors="replace")}
+        elif COMMAND_NOT_FOUND_RE.search(stderr):
+            _remember_command(tool_context, base_command, installed=False)
             return {"status": "error", "reason": "CommandNotInstalled"}
         else:
-            tool_context.state['commands'][base_command] = {'installed': True} # It exists but failed
-            return {"status": "error", "reason": "ExecutionFailed", "stdout": stdout, "stderr": stderr}
+            _remember_command(tool_context, base_command, installed=True) # It exists but failed
+            result = {"status": "error", "reason": "ExecutionFailed", "stdout": stdout.decode(errors="replace"), "stderr": stderr.decode(errors="replace")}
+
+        # Without a streamed run (Windows), the prompt is only visible once the command has exited
+        if password and wait_for_prompt and (
+            CONFIRMATION_PROMPT_RE.search(stdout) or CONFIRMATION_PROMPT_RE.search(stderr)
+        ):
+            result['awaiting_confirmation'] = True
+        return result
 
+    except subprocess.TimeoutExpired as e:
+        return {"status": "error", "reason": "Timeout", "details": f"Command did not finish within {e.timeout} seconds."}
     except Exception as e:
         return {"status": "error", "reason": "ToolException", "details": str(e)}
 